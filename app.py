@@ -1,9 +1,11 @@
+import asyncio
 import gradio as gr
 from modules.chat import chat_with_ai
 import logging
 from PIL import Image
 import io
-from modules.image_analysis import get_image_prompt
+from modules.image_analysis import get_image_prompt_async
+from modules.image_utils import check_upload_size
 import os
 from modules.video_analysis import process_video
 from enum import Enum
@@ -19,40 +21,59 @@ class VideoProcessMode(Enum):
     STANDARD = 1.0  # 标准模式：1秒/帧
     PRECISE = 0.7   # 精准模式：0.7秒/帧
 
-def chat_with_context(message, history, image=None):
-    """处理聊天和图片"""
+async def chat_with_context(message, history, image=None):
+    """处理聊天和图片，流式更新对话内容"""
+    history = history or []
     try:
         # 如果有图片，先显示在界面上
         if image is not None:
             logger.info("处理上传的图片...")
+            check_upload_size(image)
         
-        # 调用API
-        bot_response = chat_with_ai(message, history, image)
-        history.append((message, bot_response))
-        return "", history, None  # 清空输入框和图片
+        # 调用API，逐步显示已生成的回复
+        async for partial in chat_with_ai(message, history, image):
+            yield "", history + [(message, partial)], None  # 清空输入框和图片
     except Exception as e:
         logger.error(f"处理消息出错: {e}")
-        return "", history + [(message, f"抱歉，发生了错误: {str(e)}")], None
+        yield "", history + [(message, f"抱歉，发生了错误: {str(e)}")], None
 
-def analyze_images(files):
+async def analyze_images(files):
     """批量分析图片并生成提示词"""
     try:
-        results = []
         if not files:  # 检查是否有上传文件
             return "请先上传图片文件"
-            
-        for file in files:
-            if file is not None:  # 检查文件是否存在
-                logger.info(f"正在处理文件: {file.name}")
-                prompt = get_image_prompt(file.name)  # 直接传入文件路径
-                results.append(f"文件: {os.path.basename(file.name)}\n提示词描述:\n{prompt}\n{'='*50}\n")
+        
+        valid_files = [file for file in files if file is not None]  # 过滤不存在的文件
+        for file in valid_files:
+            logger.info(f"正在处理文件: {file.name}")
+        
+        # 每张图片的分析都是独立的网络请求，通过共享的异步连接池并发执行
+        async def analyze_one(path: str) -> str:
+            check_upload_size(path)
+            return await get_image_prompt_async(path)
+        
+        tasks = [analyze_one(file.name) for file in valid_files]
+        prompts = await asyncio.gather(*tasks, return_exceptions=True)
+        
+        results = []
+        for i, prompt in enumerate(prompts):
+            file = valid_files[i]
+            if isinstance(prompt, Exception):
+                logger.error(f"处理文件 {file.name} 时出错: {prompt}")
+                prompt = f"分析图片时出错: {str(prompt)}"
+            results.append(f"文件: {os.path.basename(file.name)}\n提示词描述:\n{prompt}\n{'='*50}\n")
         
         return "\n".join(results) if results else "没有找到有效的图片文件"
     except Exception as e:
         logger.error(f"批量处理图片时出错: {e}")
         return f"处理图片时发生错误: {str(e)}"
 
-def process_video_with_mode(video_file, mode: str) -> str:
+async def batched_analyze(files_list):
+    """批处理模式：将排队中的多个批量分析请求合并为一次调用"""
+    results = await asyncio.gather(*[analyze_images(files) for files in files_list])
+    return [list(results)]
+
+async def process_video_with_mode(video_file, mode: str) -> str:
     """
     根据选择的模式处理视频
     """
@@ -67,7 +88,7 @@ def process_video_with_mode(video_file, mode: str) -> str:
     }
     interval = mode_map.get(mode, VideoProcessMode.STANDARD.value)
     
-    return process_video(video_file, interval)
+    return await process_video(video_file, interval)
 
 # 在创建界面之前添加CSS样式
 css = """
@@ -105,7 +126,7 @@ with gr.Blocks(theme=gr.themes.Soft()) as demo:
                 with gr.Column(scale=1):
                     image_input = gr.Image(
                         label="上传图片",
-                        type="pil",
+                        type="filepath",  # 传入文件路径，便于检查大小并直接使用小JPEG原文件
                         sources=["upload", "clipboard"],
                         image_mode="RGB"
                     )
@@ -187,34 +208,46 @@ with gr.Blocks(theme=gr.themes.Soft()) as demo:
     submit.click(
         chat_with_context,
         inputs=[msg, chatbot, image_input],
-        outputs=[msg, chatbot, image_input]
+        outputs=[msg, chatbot, image_input],
+        concurrency_limit=10,
+        concurrency_id="api"
     )
     
     clear.click(lambda: None, None, chatbot)  # 清除对话历史
     
     # 批量分析图片事件
     analyze_btn.click(
-        analyze_images,
+        batched_analyze,
         inputs=[file_output],
-        outputs=[result_text]
+        outputs=[result_text],
+        batch=True,
+        max_batch_size=8,
+        concurrency_limit=10,
+        concurrency_id="api"
     )
     
     extract_btn.click(
         process_video_with_mode,
         inputs=[video_input_subtitle, mode_select],
-        outputs=[subtitle_output]
+        outputs=[subtitle_output],
+        concurrency_limit=2,
+        concurrency_id="video_cpu"
     )
     
     audio_btn.click(
         process_video_audio,
         inputs=[video_input_audio],
-        outputs=[audio_output]
+        outputs=[audio_output],
+        concurrency_limit=2,
+        concurrency_id="video_cpu"
     )
     
     smart_summary_btn.click(
         process_video_summary,
         inputs=[video_input_smart_summary],
-        outputs=[smart_summary_output]
+        outputs=[smart_summary_output],
+        concurrency_limit=2,
+        concurrency_id="video_cpu"
     )
     
     # 在底部添加链接，使用更美观的样式
@@ -247,6 +280,7 @@ with gr.Blocks(theme=gr.themes.Soft()) as demo:
 
 if __name__ == "__main__":
     logger.info("正在启动服务器...")
+    demo.queue(default_concurrency_limit=5, max_size=128)  # 对话/图片与视频任务分别限流，互不阻塞
     demo.launch(
         server_port=7860,
         show_api=False,
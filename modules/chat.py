@@ -1,10 +1,10 @@
-from groq import Groq
+from groq import AsyncGroq
 import logging
 import os
+import re
+from collections import OrderedDict
 from dotenv import load_dotenv
-import base64
-from PIL import Image
-import io
+from modules.image_utils import encode_resized_jpeg_b64
 
 # 加载环境变量
 load_dotenv()
@@ -16,40 +16,56 @@ api_key = os.getenv('GROQ_API_KEY')
 if not api_key:
     raise ValueError("未找到API密钥，请在.env文件中设置GROQ_API_KEY")
 
-client = Groq(api_key=api_key)
+client = AsyncGroq(api_key=api_key)
 
-def encode_image_to_base64(image):
-    """将图片转换为base64格式，并进行压缩"""
-    if image is None:
-        return None
-        
-    try:
-        # 转换为RGB模式（如果是RGBA）
-        if image.mode == 'RGBA':
-            image = image.convert('RGB')
-        
-        # 设置最大尺寸为 1200 像素
-        max_size = 1200
-        ratio = min(max_size/float(image.size[0]), max_size/float(image.size[1]))
-        if ratio < 1:
-            new_size = tuple(int(dim * ratio) for dim in image.size)
-            image = image.resize(new_size, Image.Resampling.LANCZOS)
-        
-        # 保持高质量设置
-        buffered = io.BytesIO()
-        image.save(buffered, format="JPEG", quality=95, optimize=True)
-        img_str = base64.b64encode(buffered.getvalue()).decode()
-        return img_str
-        
-    except Exception as e:
-        logger.error(f"图片编码错误: {e}")
-        return None
+# 匹配中文字符，用于判断回复是否为中文
+_CJK_RE = re.compile(r'[\u4e00-\u9fff]')
 
-def chat_with_ai(message: str, history=None, image=None) -> str:
+# 要求模型始终使用中文回答的系统提示词
+SYSTEM_PROMPT = "请始终使用简体中文回答，无论输入语言。"
+
+# 纯文本对话的LRU缓存，键为 (消息, 历史记录)
+RESPONSE_CACHE_SIZE = 512
+_response_cache = OrderedDict()
+
+def _cache_key(message: str, history) -> tuple:
+    """生成纯文本对话的缓存键"""
+    return (message, tuple((str(human), str(assistant)) for human, assistant in (history or [])))
+
+async def _stream_completion(messages: list):
+    """流式调用Groq API，每收到新内容就返回当前累计的完整回复"""
+    stream = await client.chat.completions.create(
+        model="llama-3.2-90b-vision-preview",
+        messages=messages,
+        temperature=0.7,
+        max_tokens=1024,
+        top_p=1,
+        stream=True,
+        stop=None
+    )
+    
+    response = ""
+    async for chunk in stream:
+        if not chunk.choices:
+            continue
+        delta = chunk.choices[0].delta.content or ""
+        if delta:
+            response += delta
+            yield response
+
+async def chat_with_ai(message: str, history=None, image=None):
     """
-    与Groq AI进行对话
+    与Groq AI进行对话，以流式方式逐步返回已生成的回复内容
     """
     try:
+        # 纯文本对话先查缓存
+        cache_key = _cache_key(message, history) if image is None else None
+        if cache_key is not None and cache_key in _response_cache:
+            _response_cache.move_to_end(cache_key)
+            logger.info("命中对话缓存")
+            yield _response_cache[cache_key]
+            return
+        
         # 准备消息历史
         messages = []
         
@@ -60,7 +76,11 @@ def chat_with_ai(message: str, history=None, image=None) -> str:
         
         # 处理图片
         if image is not None:
-            base64_image = encode_image_to_base64(image)
+            try:
+                base64_image = encode_resized_jpeg_b64(image)
+            except Exception as e:
+                logger.error(f"图片编码错误: {e}")
+                base64_image = None
             if base64_image:
                 # 构建包含图片的消息
                 messages.append({
@@ -84,49 +104,38 @@ def chat_with_ai(message: str, history=None, image=None) -> str:
                     "content": f"{message} (图片处理失败)"
                 })
         else:
-            # 纯文本消息
+            # 纯文本消息，通过系统提示词要求中文回复
+            # (视觉模型不支持在带图片的请求中使用 system message，因此仅在纯文本时添加)
+            messages.insert(0, {"role": "system", "content": SYSTEM_PROMPT})
             messages.append({
                 "role": "user",
-                "content": message + " (请用中文回复)"
+                "content": message
             })
         
         logger.info("正在发送请求到Groq API...")
         
-        # 调用Groq API，使用新的模型名称
-        completion = client.chat.completions.create(
-            model="llama-3.2-90b-vision-preview",  # 更新模型名称
-            messages=messages,
-            temperature=0.7,
-            max_tokens=1024,
-            top_p=1,
-            stream=False,
-            stop=None
-        )
-        
-        response = completion.choices[0].message.content
+        # 调用Groq API，流式接收回复
+        response = ""
+        async for response in _stream_completion(messages):
+            yield response
         
-        # 如果响应不是中文，请求中文翻译
-        if not any('\u4e00' <= char <= '\u9fff' for char in response):
+        # 如果响应仍不是中文，再请求一次中文翻译（兜底）
+        if _CJK_RE.search(response) is None:
             messages.append({"role": "assistant", "content": response})
             messages.append({
                 "role": "user",
                 "content": "请用中文重新表达上述内容"
             })
             
-            completion = client.chat.completions.create(
-                model="llama-3.2-90b-vision-preview",  # 这里也更新模型名称
-                messages=messages,
-                temperature=0.7,
-                max_tokens=1024,
-                top_p=1,
-                stream=False,
-                stop=None
-            )
-            response = completion.choices[0].message.content
+            async for response in _stream_completion(messages):
+                yield response
         
-        return response
+        if cache_key is not None:
+            _response_cache[cache_key] = response
+            if len(_response_cache) > RESPONSE_CACHE_SIZE:
+                _response_cache.popitem(last=False)
         
     except Exception as e:
         logger.error(f"API调用错误: {e}")
         logger.error(f"错误详情: {str(e)}")
-        return f"抱歉，发生了错误: {str(e)}"
\ No newline at end of file
+        yield f"抱歉，发生了错误: {str(e)}"
\ No newline at end of file
@@ -1,26 +1,70 @@
 import logging
-import base64
-from io import BytesIO
+import asyncio
 from PIL import Image
 import httpx
+import diskcache
 import json
 import os
 from typing import Union
+from modules.image_utils import encode_resized_jpeg_b64, image_digest
 
 logger = logging.getLogger(__name__)
 
 GROQ_API_KEY = os.getenv("GROQ_API_KEY")
 GROQ_API_URL = "https://api.groq.com/openai/v1/chat/completions"
 
-def encode_image_to_base64(image: Union[Image.Image, str]) -> str:
-    """将图片转换为base64编码"""
-    if isinstance(image, str):
-        with open(image, 'rb') as img_file:
-            return base64.b64encode(img_file.read()).decode('utf-8')
+# 按图片内容缓存分析结果，重复上传同一张图片时无需再次调用API
+PROMPT_CACHE_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), ".cache", "img_prompts")
+PROMPT_CACHE_EXPIRE = 7 * 24 * 3600  # 缓存7天
+_prompt_cache = diskcache.Cache(PROMPT_CACHE_DIR)
+
+# 复用连接池，避免每次请求都重新进行 TLS 握手；HTTP/2 可在同一连接上并发多个请求
+_HTTP_LIMITS = httpx.Limits(max_connections=32, max_keepalive_connections=32)
+_HTTP_HEADERS = {
+    "Authorization": f"Bearer {GROQ_API_KEY}",
+    "Content-Type": "application/json"
+}
+_http_client = httpx.Client(http2=True, timeout=60.0, limits=_HTTP_LIMITS, headers=_HTTP_HEADERS)
+_async_http_client = httpx.AsyncClient(http2=True, timeout=60.0, limits=_HTTP_LIMITS, headers=_HTTP_HEADERS)
+
+def _build_payload(base64_image: str) -> dict:
+    """构建图片分析请求体"""
+    # 构建请求消息 - 移除 system message
+    messages = [
+        {
+            "role": "user",
+            "content": [
+                {
+                    "type": "text",
+                    "text": "你是一个专业的图片分析助手。请详细分析这张图片，生成详细的提示词描述，包括：1. 主要内容和主体 2. 艺术风格 3. 构图方式 4. 光影效果 5. 色彩搭配 6. 其他特殊细节。请用中文回答，尽可能详细和专业。"
+                },
+                {
+                    "type": "image_url",
+                    "image_url": {
+                        "url": f"data:image/jpeg;base64,{base64_image}"
+                    }
+                }
+            ]
+        }
+    ]
+    
+    return {
+        "model": "llama-3.2-90b-vision-preview",
+        "messages": messages,
+        "temperature": 0.7,
+        "max_tokens": 1000,
+        "stream": False
+    }
+
+def _parse_response(response: httpx.Response) -> str:
+    """解析API响应，返回提示词或错误信息"""
+    if response.status_code == 200:
+        result = response.json()
+        return result['choices'][0]['message']['content']
     else:
-        buffered = BytesIO()
-        image.save(buffered, format="JPEG")
-        return base64.b64encode(buffered.getvalue()).decode('utf-8')
+        error_msg = f"API请求失败: {response.status_code} - {response.text}"
+        logger.error(error_msg)
+        return f"分析图片时出错: {error_msg}"
 
 def get_image_prompt(image: Union[Image.Image, str]) -> str:
     """
@@ -31,59 +75,54 @@ def get_image_prompt(image: Union[Image.Image, str]) -> str:
         str: 生成的提示词描述
     """
     try:
+        # 命中缓存则直接返回
+        digest = image_digest(image)
+        cached = _prompt_cache.get(digest)
+        if cached is not None:
+            logger.info("命中图片提示词缓存")
+            return cached
+        
         # 将图片转换为base64
-        base64_image = encode_image_to_base64(image)
+        base64_image = encode_resized_jpeg_b64(image, digest)
         
-        # 构建请求消息 - 移除 system message
-        messages = [
-            {
-                "role": "user",
-                "content": [
-                    {
-                        "type": "text",
-                        "text": "你是一个专业的图片分析助手。请详细分析这张图片，生成详细的提示词描述，包括：1. 主要内容和主体 2. 艺术风格 3. 构图方式 4. 光影效果 5. 色彩搭配 6. 其他特殊细节。请用中文回答，尽可能详细和专业。"
-                    },
-                    {
-                        "type": "image_url",
-                        "image_url": {
-                            "url": f"data:image/jpeg;base64,{base64_image}"
-                        }
-                    }
-                ]
-            }
-        ]
-
         # 发送请求到Groq API
-        headers = {
-            "Authorization": f"Bearer {GROQ_API_KEY}",
-            "Content-Type": "application/json"
-        }
-        
-        payload = {
-            "model": "llama-3.2-90b-vision-preview",
-            "messages": messages,
-            "temperature": 0.7,
-            "max_tokens": 1000,
-            "stream": False
-        }
+        response = _http_client.post(GROQ_API_URL, json=_build_payload(base64_image))
+        prompt = _parse_response(response)
+        if response.status_code == 200:
+            _prompt_cache.set(digest, prompt, expire=PROMPT_CACHE_EXPIRE)
+        return prompt
 
-        with httpx.Client(timeout=30.0) as client:
-            response = client.post(
-                GROQ_API_URL,
-                headers=headers,
-                json=payload,
-                timeout=60.0
-            )
-            
-            if response.status_code == 200:
-                result = response.json()
-                return result['choices'][0]['message']['content']
-            else:
-                error_msg = f"API请求失败: {response.status_code} - {response.text}"
-                logger.error(error_msg)
-                return f"分析图片时出错: {error_msg}"
+    except Exception as e:
+        error_msg = f"生成图片提示词时出错: {str(e)}"
+        logger.error(error_msg)
+        return error_msg
+
+async def get_image_prompt_async(image: Union[Image.Image, str]) -> str:
+    """
+    get_image_prompt 的异步版本，供批量分析时并发调用
+    Args:
+        image: PIL.Image对象或图片文件路径
+    Returns:
+        str: 生成的提示词描述
+    """
+    try:
+        # 命中缓存则直接返回
+        digest = await asyncio.to_thread(image_digest, image)
+        cached = _prompt_cache.get(digest)
+        if cached is not None:
+            logger.info("命中图片提示词缓存")
+            return cached
+        
+        # 图片编码是CPU操作，放到线程中执行，避免阻塞事件循环
+        base64_image = await asyncio.to_thread(encode_resized_jpeg_b64, image, digest)
+        
+        response = await _async_http_client.post(GROQ_API_URL, json=_build_payload(base64_image))
+        prompt = _parse_response(response)
+        if response.status_code == 200:
+            _prompt_cache.set(digest, prompt, expire=PROMPT_CACHE_EXPIRE)
+        return prompt
 
     except Exception as e:
         error_msg = f"生成图片提示词时出错: {str(e)}"
         logger.error(error_msg)
-        return error_msg
\ No newline at end of file
+        return error_msg
@@ -0,0 +1,100 @@
+import base64
+import hashlib
+import os
+from collections import OrderedDict
+from typing import Optional, Union
+import cv2
+import numpy as np
+from PIL import Image
+
+# 发送给模型的图片最大边长（像素）
+MAX_IMAGE_SIZE = 1200
+JPEG_QUALITY = 85
+
+# 小于该大小且尺寸合适的JPEG文件直接发送原始数据，无需重新编码
+FAST_PATH_MAX_BYTES = 400_000
+
+# 图片上传大小上限，超出时直接拒绝，不做解码和编码
+MAX_UPLOAD_BYTES = 20 * 1024 * 1024
+
+# 编码结果缓存，同一张图片只做一次缩放和JPEG编码
+ENCODE_CACHE_SIZE = 32
+_encode_cache = OrderedDict()
+
+def check_upload_size(path: str):
+    """图片文件超过 MAX_UPLOAD_BYTES 时抛出 ValueError"""
+    if os.path.getsize(path) > MAX_UPLOAD_BYTES:
+        raise ValueError(f"图片大小超过 {MAX_UPLOAD_BYTES // (1024 * 1024)}MB，请压缩后再上传")
+
+def image_digest(image: Union[Image.Image, str]) -> str:
+    """
+    计算图片内容的SHA-256摘要，用于缓存
+    Args:
+        image: PIL.Image对象或图片文件路径
+    Returns:
+        str: 十六进制摘要
+    """
+    digest = hashlib.sha256()
+    if isinstance(image, str):
+        with open(image, 'rb') as img_file:
+            for chunk in iter(lambda: img_file.read(1 << 20), b''):
+                digest.update(chunk)
+    else:
+        digest.update(f"{image.mode}:{image.size}".encode())
+        digest.update(image.tobytes())
+    return digest.hexdigest()
+
+def encode_resized_jpeg_b64(image: Union[Image.Image, str], digest: Optional[str] = None) -> str:
+    """
+    将图片缩放到不超过 MAX_IMAGE_SIZE 后编码为 JPEG 的 base64 字符串，结果按图片摘要缓存
+    Args:
+        image: PIL.Image对象或图片文件路径
+        digest: 已计算好的 image_digest，为空时自动计算
+    Returns:
+        str: base64编码的JPEG数据
+    """
+    if digest is None:
+        digest = image_digest(image)
+    if digest in _encode_cache:
+        _encode_cache.move_to_end(digest)
+        return _encode_cache[digest]
+    
+    encoded = _encode(image)
+    _encode_cache[digest] = encoded
+    if len(_encode_cache) > ENCODE_CACHE_SIZE:
+        _encode_cache.popitem(last=False)
+    return encoded
+
+def _encode(image: Union[Image.Image, str]) -> str:
+    """缩放并编码图片"""
+    if isinstance(image, str):
+        with Image.open(image) as opened:
+            # 已经是尺寸合适的小JPEG时直接使用原文件，跳过解码和重新编码
+            if (opened.format == 'JPEG'
+                    and opened.mode in ('RGB', 'L')
+                    and max(opened.size) <= MAX_IMAGE_SIZE
+                    and os.path.getsize(image) < FAST_PATH_MAX_BYTES):
+                with open(image, 'rb') as img_file:
+                    return base64.b64encode(img_file.read()).decode('utf-8')
+            return _encode(opened)
+    
+    # JPEG 不支持透明通道等模式，统一转换为RGB
+    if image.mode not in ('RGB', 'L'):
+        image = image.convert('RGB')
+    
+    # 使用 OpenCV 缩放和编码（SIMD 加速的 resize 与 libjpeg-turbo）
+    array = np.asarray(image)
+    if image.mode == 'RGB':
+        array = cv2.cvtColor(array, cv2.COLOR_RGB2BGR)
+    
+    # 按比例缩放，保证最长边不超过最大尺寸
+    height, width = array.shape[:2]
+    ratio = min(MAX_IMAGE_SIZE/float(width), MAX_IMAGE_SIZE/float(height))
+    if ratio < 1:
+        new_size = (int(width * ratio), int(height * ratio))
+        array = cv2.resize(array, new_size, interpolation=cv2.INTER_LANCZOS4)
+    
+    ok, buffer = cv2.imencode('.jpg', array, [int(cv2.IMWRITE_JPEG_QUALITY), JPEG_QUALITY])
+    if not ok:
+        raise ValueError("JPEG编码失败")
+    return base64.b64encode(buffer).decode('utf-8')
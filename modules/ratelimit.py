@@ -0,0 +1,39 @@
+import time
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+RPM_LIMIT = 15  # Groq API 每分钟请求限制
+
+class TokenBucket:
+    """
+    令牌桶速率限制器（协程安全）
+    桶容量为每分钟请求数，允许突发请求，令牌按 rpm/60 个每秒匀速补充
+    """
+    def __init__(self, rpm: int):
+        self.capacity = rpm
+        self.tokens = float(rpm)
+        self.rate = rpm / 60.0
+        # 使用单调时钟，不受系统时间校准影响
+        self.last_refill = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.last_refill) * self.rate)
+        self.last_refill = now
+
+    async def acquire(self):
+        """取得一个令牌，桶空时等待补充"""
+        async with self.lock:
+            self._refill()
+            if self.tokens < 1:
+                sleep_time = (1 - self.tokens) / self.rate
+                logger.info(f"等待 {sleep_time:.2f} 秒以遵守速率限制...")
+                await asyncio.sleep(sleep_time)
+                self._refill()
+            self.tokens -= 1
+
+# 所有模块共用同一个实例，共享同一个 API 配额
+rate_limiter = TokenBucket(RPM_LIMIT)
@@ -1,16 +1,15 @@
-import os
 import logging
-import tempfile
+import asyncio
 from typing import List, Tuple, Dict
-from difflib import SequenceMatcher
+from rapidfuzz import fuzz, process
 from modules.video_analysis import extract_subtitles
 from modules.audio_analysis import extract_audio_from_video, transcribe_audio
 
 logger = logging.getLogger(__name__)
 
 def similar(a: str, b: str) -> float:
-    """计算两个字符串的相似度"""
-    return SequenceMatcher(None, a, b).ratio()
+    """计算两个字符串的相似度（0-1）"""
+    return fuzz.ratio(a, b) / 100.0
 
 def merge_subtitles(video_subs: List[Tuple[float, str]], audio_subs: List[Tuple[float, str]]) -> List[Tuple[float, str]]:
     """
@@ -29,15 +28,17 @@ def merge_subtitles(video_subs: List[Tuple[float, str]], audio_subs: List[Tuple[
         best_score = 0
         matched_time = None
         
-        # 在音频字幕中寻找最佳匹配
-        for a_time in range(max(0, v_time_int - 2), v_time_int + 3):  # 检查前后2秒
-            if a_time in audio_dict and a_time not in used_audio:
-                a_text = audio_dict[a_time]
-                score = similar(v_text, a_text)
-                if score > best_score and score > 0.3:  # 设置最小相似度阈值
-                    best_score = score
-                    best_match = a_text
-                    matched_time = a_time
+        # 在音频字幕中寻找最佳匹配（检查前后2秒，按时间直接查字典）
+        candidates = {
+            a_time: audio_dict[a_time]
+            for a_time in range(max(0, v_time_int - 2), v_time_int + 3)
+            if a_time in audio_dict and a_time not in used_audio
+        }
+        if candidates:
+            # 设置最小相似度阈值为 30（0-100）
+            match = process.extractOne(v_text, candidates, scorer=fuzz.ratio, score_cutoff=30)
+            if match:
+                best_match, best_score, matched_time = match
         
         if best_match:
             # 如果找到匹配的音频字幕，选择较长的那个
@@ -69,33 +70,33 @@ def merge_subtitles(video_subs: List[Tuple[float, str]], audio_subs: List[Tuple[
     # 按时间排序
     merged.sort(key=lambda x: x[0])
     
-    # 清理并去重
-    final_subs = []
-    seen_texts.clear()  # 重新清空集合
-    
+    # 清理文本，跳过空文本或太短的文本
+    cleaned = []
     for time, text in merged:
-        # 清理文本
         text = text.strip()
         text = text.replace("抖音", "").strip()
-        
-        # 跳过空文本或太短的文本
-        if not text or len(text) < 2:
+        if text and len(text) >= 2:
+            cleaned.append((time, text))
+    
+    if not cleaned:
+        return []
+    
+    # 一次性计算所有文本两两之间的相似度矩阵
+    texts = [text for _, text in cleaned]
+    scores = process.cdist(texts, texts, scorer=fuzz.ratio)
+    
+    # 检查是否与已保留的文本过于相似（相似度阈值 70）
+    final_subs = []
+    kept = []
+    for i, (time, text) in enumerate(cleaned):
+        if kept and (scores[i, kept] > 70).any():
             continue
-        
-        # 检查是否与已有文本过于相似
-        is_similar = False
-        for seen_text in seen_texts:
-            if similar(text, seen_text) > 0.7:  # 设置相似度阈值
-                is_similar = True
-                break
-        
-        if not is_similar:
-            seen_texts.add(text)
-            final_subs.append((time, text))
+        kept.append(i)
+        final_subs.append((time, text))
     
     return final_subs
 
-def process_smart_subtitle(video_file) -> str:
+async def process_smart_subtitle(video_file) -> str:
     """
     智能处理视频字幕，结合视频帧OCR和音频识别结果
     """
@@ -103,21 +104,32 @@ def process_smart_subtitle(video_file) -> str:
         return "请上传视频文件"
     
     try:
-        # 创建临时文件
-        with tempfile.NamedTemporaryFile(delete=False, suffix='.mp4') as temp_video:
-            temp_video_path = temp_video.name
-            with open(video_file.name, 'rb') as f:
-                temp_video.write(f.read())
+        # 上传的文件已经在磁盘上，直接使用其路径，无需再复制一份
+        video_path = video_file.name
         
         logger.info(f"开始智能提取字幕: {video_file.name}")
         
-        # 1. 提取视频字幕
-        video_subtitles = extract_subtitles(temp_video_path, interval_seconds=1.0)
-        logger.info("完成视频字幕提取")
+        async def extract_audio_subtitles() -> str:
+            audio_bytes = await extract_audio_from_video(video_path)
+            return await transcribe_audio(audio_bytes)
+        
+        # 1/2. 视频帧OCR与音频识别互不依赖，并行执行
+        video_subtitles, audio_content = await asyncio.gather(
+            extract_subtitles(video_path, 1.0),
+            extract_audio_subtitles(),
+            return_exceptions=True
+        )
+        
+        # 单独处理每个任务的异常，一方失败时仍返回另一方的结果
+        if isinstance(video_subtitles, Exception):
+            logger.error(f"提取视频字幕时出错: {video_subtitles}")
+            video_subtitles = []
+        else:
+            logger.info("完成视频字幕提取")
         
-        # 2. 提取音频字幕
-        audio_path = extract_audio_from_video(temp_video_path)
-        audio_content = transcribe_audio(audio_path)
+        if isinstance(audio_content, Exception):
+            logger.error(f"提取音频字幕时出错: {audio_content}")
+            audio_content = ""
         
         # 解析音频内容为时间戳格式
         audio_subtitles = []
@@ -146,8 +158,4 @@ def process_smart_subtitle(video_file) -> str:
         
     except Exception as e:
         logger.error(f"智能提取字幕时出错: {e}")
-        return f"处理出错: {str(e)}"
-    finally:
-        # 清理临时文件
-        if os.path.exists(temp_video_path):
-            os.unlink(temp_video_path) 
\ No newline at end of file
+        return f"处理出错: {str(e)}" 
\ No newline at end of file
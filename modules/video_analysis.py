@@ -2,104 +2,337 @@ import cv2
 import numpy as np
 import logging
 import os
-from typing import List, Tuple
-import tempfile
+import re
+from typing import Dict, Iterator, List, Optional, Tuple
 import base64
-from io import BytesIO
 import httpx
-from PIL import Image
-import time
+import queue
+import asyncio
+import threading
+import hashlib
+from rapidfuzz import fuzz
 from tenacity import retry, stop_after_attempt, wait_exponential
+from modules.ratelimit import RPM_LIMIT, rate_limiter
+
+try:
+    import av
+    from av.codec.hwaccel import HWAccel, hwdevices_available
+except ImportError:  # 未安装 PyAV 时只使用 OpenCV 解码
+    av = None
 
 logger = logging.getLogger(__name__)
 
 GROQ_API_KEY = os.getenv("GROQ_API_KEY")
 GROQ_API_URL = "https://api.groq.com/openai/v1/chat/completions"
-RPM_LIMIT = 15  # Groq API 每分钟请求限制
-MIN_REQUEST_INTERVAL = 60.0 / RPM_LIMIT  # 每次请求的最小间隔时间（秒）
-
-class RateLimiter:
-    def __init__(self, rpm_limit):
-        self.min_interval = 60.0 / rpm_limit
-        self.last_request_time = 0
-
-    def wait_if_needed(self):
-        """等待必要的时间以遵守速率限制"""
-        current_time = time.time()
-        elapsed = current_time - self.last_request_time
-        if elapsed < self.min_interval:
-            sleep_time = self.min_interval - elapsed
-            logger.info(f"等待 {sleep_time:.2f} 秒以遵守速率限制...")
-            time.sleep(sleep_time)
-        self.last_request_time = time.time()
-
-# 创建速率限制器实例
-rate_limiter = RateLimiter(RPM_LIMIT)
-
-def extract_frames(video_path: str, interval: int = 15) -> List[np.ndarray]:
+
+FRAME_QUEUE_SIZE = 16  # 解码帧队列上限，避免长视频占用过多内存
+MAX_IN_FLIGHT = RPM_LIMIT  # 同时等待API响应的帧数上限
+MAX_FRAME_WIDTH = 1920  # 帧的最大宽度，超出时等比缩小
+FRAME_KEY_WIDTH = 256  # 计算画面指纹时字幕区域缩放到的宽度
+LLM_MAX_SIDE = 1024  # 发送给模型的图片最长边，模型识别不需要全高清画面
+LLM_JPEG_QUALITY = 60  # 发送给模型的图片 JPEG 质量
+HWACCEL_DEVICES = ("cuda", "qsv", "videotoolbox", "d3d11va", "vaapi")  # 按优先级尝试的硬件解码设备
+
+# 在句末标点之后及原有换行处切分句子
+_SENT_SPLIT = re.compile(r'(?<=[。？！])\s*|\n')
+
+# 识别结果包含这些词时，多半是模型的解释而不是实际字幕
+IGNORE_PHRASES = (
+    "图片中", "显示", "字幕是", "内容是", "文字是",
+    "我看到", "这是", "这个", "有", "没有",
+    "字幕内容", "文本", "识别到"
+)
+_IGNORE_RE = re.compile('|'.join(map(re.escape, IGNORE_PHRASES)))
+
+# 所有帧复用同一个连接池，保持长连接并通过 HTTP/2 多路复用
+http_client = httpx.AsyncClient(
+    http2=True,
+    timeout=60.0,
+    limits=httpx.Limits(max_connections=100, max_keepalive_connections=20),
+    headers={
+        "Authorization": f"Bearer {GROQ_API_KEY}",
+        "Content-Type": "application/json"
+    }
+)
+
+def _scaled_size(width: int, height: int) -> Optional[Tuple[int, int]]:
+    """宽度超过 MAX_FRAME_WIDTH 时返回等比缩小后的尺寸 (宽, 高)，否则返回 None"""
+    if width > MAX_FRAME_WIDTH:
+        return (MAX_FRAME_WIDTH, int(height * MAX_FRAME_WIDTH / width))
+    return None
+
+def frame_target_size(cap: cv2.VideoCapture) -> Optional[Tuple[int, int]]:
+    """根据视频分辨率计算缩放后的尺寸 (宽, 高)，无需缩放时返回 None"""
+    return _scaled_size(int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)), int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)))
+
+def resize_frame(frame: np.ndarray, target_size: Optional[Tuple[int, int]]) -> np.ndarray:
+    """按预先计算的尺寸缩小帧，缩小时 INTER_AREA 比默认的 INTER_LINEAR 更快、效果更好"""
+    if target_size is None:
+        return frame
+    return cv2.resize(frame, target_size, interpolation=cv2.INTER_AREA)
+
+def iter_sampled_frames(cap: cv2.VideoCapture, interval: int, total_frames: int):
+    """
+    按帧间隔跳转读取视频帧，只解码需要的帧
+    Returns:
+        生成 (帧序号, 帧) 元组
     """
-    从视频中提取帧
+    position = 0  # 下一次 read() 将读取的帧序号
+    for frame_index in range(0, total_frames, interval):
+        if frame_index != position and not cap.set(cv2.CAP_PROP_POS_FRAMES, frame_index):
+            # 不支持跳转时，顺序跳过中间帧（grab 不做解码后的格式转换）
+            while position < frame_index:
+                if not cap.grab():
+                    return
+                position += 1
+        ret, frame = cap.read()
+        if not ret:
+            return
+        position = frame_index + 1
+        yield frame_index, frame
+
+def iter_cv2_frames(cap: cv2.VideoCapture, interval_seconds: float):
+    """
+    使用 OpenCV 按时间间隔抽帧并缩小
+    Returns:
+        生成 (时间戳, 帧) 元组
     """
-    frames = []
+    fps = int(cap.get(cv2.CAP_PROP_FPS))
+    total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    interval = max(1, int(fps * interval_seconds))
+    target_size = frame_target_size(cap)
+    for frame_index, frame in iter_sampled_frames(cap, interval, total_frames):
+        yield frame_index / fps, resize_frame(frame, target_size)
+
+# 按视频编码缓存探测结论：(编码, profile) -> 可用的硬件解码设备，None 表示没有可用设备
+_hwaccel_lock = threading.Lock()
+_hwaccel_devices: Dict[Tuple[str, Optional[str]], Optional[str]] = {}
+
+def _codec_key(video_path: str) -> Tuple[str, Optional[str]]:
+    """读取视频流的编码和 profile，不同编码的硬件支持情况不同"""
+    with av.open(video_path) as container:
+        codec_context = container.streams.video[0].codec_context
+        return codec_context.name, codec_context.profile
+
+def _decodes_first_frame(video_path: str, device: Optional[str] = None) -> bool:
+    """尝试解码一帧，device 为空时使用软件解码；无法创建设备或无法解码时返回 False"""
     try:
-        cap = cv2.VideoCapture(video_path)
-        total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
-        fps = int(cap.get(cv2.CAP_PROP_FPS))
+        hwaccel = HWAccel(device_type=device, allow_software_fallback=False) if device else None
+        with av.open(video_path, hwaccel=hwaccel) as container:
+            next(container.decode(video=0), None)
+        return True
+    except (av.error.FFmpegError, OSError) as e:
+        logger.info(f"解码测试失败 ({device or '软件解码'}): {e}")
+        return False
+
+def _detect_hwaccel(video_path: str) -> Optional[str]:
+    """
+    返回能解码该视频的硬件设备，没有可用设备时返回 None
+    hwdevices_available() 只列出 FFmpeg 编译时支持的设备类型，必须实际解码才能确认
+    """
+    with _hwaccel_lock:
+        try:
+            key = _codec_key(video_path)
+        except (av.error.FFmpegError, OSError, IndexError) as e:
+            logger.info(f"无法读取视频编码信息: {e}")
+            return None
+        if key in _hwaccel_devices:
+            return _hwaccel_devices[key]
         
-        # 每秒提取1帧
-        interval = max(1, int(fps))
-        frame_count = 0
+        available = set(hwdevices_available())
+        for device in HWACCEL_DEVICES:
+            if device in available and _decodes_first_frame(video_path, device):
+                logger.info(f"{key[0]} 使用硬件解码: {device}")
+                _hwaccel_devices[key] = device
+                return device
         
-        while cap.isOpened():
-            ret, frame = cap.read()
-            if not ret:
-                break
-                
-            if frame_count % interval == 0:
-                # 调整图片大小，提高处理速度
-                height, width = frame.shape[:2]
-                if width > 1920:
-                    scale = 1920 / width
-                    frame = cv2.resize(frame, None, fx=scale, fy=scale)
-                frames.append(frame)
-            frame_count += 1
+        # 软件解码也失败说明是文件本身的问题，不记录结论，之后的视频重新探测
+        if _decodes_first_frame(video_path):
+            _hwaccel_devices[key] = None
+        return None
+
+def _open_container(video_path: str):
+    """打开视频，有可用的硬件设备时启用硬件解码，失败时改为软件解码"""
+    device = _detect_hwaccel(video_path)
+    if device is not None:
+        try:
+            return av.open(video_path, hwaccel=HWAccel(device_type=device, allow_software_fallback=True))
+        except (av.error.FFmpegError, OSError) as e:
+            logger.warning(f"硬件解码打开失败，改为软件解码: {e}")
+    return av.open(video_path)
+
+def iter_pyav_frames(video_path: str, interval_seconds: float):
+    """
+    使用 PyAV 顺序解码并按时间间隔抽帧，有硬件解码器时交给硬件解码
+    Returns:
+        生成 (时间戳, 帧) 元组
+    """
+    with _open_container(video_path) as container:
+        stream = container.streams.video[0]
+        stream.thread_type = "AUTO"
+        start_time = float(stream.start_time * stream.time_base) if stream.start_time is not None else 0.0
+        target_size = _scaled_size(stream.codec_context.width, stream.codec_context.height)
+        
+        next_time = 0.0
+        for frame in container.decode(stream):
+            if frame.time is None:
+                continue
+            timestamp = frame.time - start_time
+            if timestamp < next_time:
+                continue
+            while next_time <= timestamp:
+                next_time += interval_seconds
             
-        cap.release()
-        return frames
+            # 缩放和颜色转换都交给 swscale 一次完成
+            if target_size is not None:
+                frame = frame.reformat(width=target_size[0], height=target_size[1], interpolation="AREA")
+            yield timestamp, frame.to_ndarray(format="bgr24")
+
+def resolve_decode_backend(decode_backend: str, video_path: str) -> str:
+    """
+    确定实际使用的解码方式
+    Args:
+        decode_backend: "auto"（已安装 PyAV 且有可用的硬件解码设备时使用 PyAV，
+            否则使用 OpenCV 跳帧读取，避免软件顺序解码每一帧）、"pyav" 或 "cv2"
+        video_path: 用于探测硬件解码设备的视频
+    """
+    if decode_backend == "auto":
+        return "pyav" if av is not None and _detect_hwaccel(video_path) is not None else "cv2"
+    if decode_backend == "pyav" and av is None:
+        raise ImportError("未安装 PyAV，无法使用 pyav 解码")
+    if decode_backend not in ("pyav", "cv2"):
+        raise ValueError(f"未知的解码方式: {decode_backend}")
+    return decode_backend
+
+class FrameProducer(threading.Thread):
+    """
+    后台解码线程：读取 (时间戳, 帧) 放入有界队列，结束时放入 None
+    解码与API请求并行，队列满时阻塞以限制内存占用
+    """
+    def __init__(self, frames: Iterator[Tuple[float, np.ndarray]], maxsize: int = FRAME_QUEUE_SIZE):
+        super().__init__(daemon=True)
+        self.frames = frames
+        self.queue = queue.Queue(maxsize=maxsize)
+        self._stop_event = threading.Event()
+
+    def stop(self):
+        """通知解码线程提前结束"""
+        self._stop_event.set()
+
+    def _put(self, item) -> bool:
+        """放入队列，队列满时等待；被停止时返回 False"""
+        while not self._stop_event.is_set():
+            try:
+                self.queue.put(item, timeout=0.5)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def run(self):
+        try:
+            for item in self.frames:
+                if not self._put(item):
+                    return
+        except Exception as e:
+            logger.error(f"解码视频帧时出错: {e}")
+        finally:
+            # 提前停止时也要关闭生成器，释放解码器
+            self.frames.close()
+            # 结束标记
+            self._put(None)
+
+def extract_frames(video_path: str, interval: int = 15, decode_backend: str = "auto") -> Iterator[np.ndarray]:
+    """
+    从视频中提取帧（每秒1帧）
+    Returns:
+        逐帧生成，调用方处理完即可释放，避免长视频的所有帧同时驻留内存
+    """
+    try:
+        if resolve_decode_backend(decode_backend, video_path) == "pyav":
+            for _, frame in iter_pyav_frames(video_path, 1.0):
+                yield frame
+            return
+        
+        cap = cv2.VideoCapture(video_path)
+        try:
+            for _, frame in iter_cv2_frames(cap, 1.0):
+                yield frame
+        finally:
+            cap.release()
     except Exception as e:
         logger.error(f"提取视频帧时出错: {e}")
         raise
 
+def _prepare_for_llm(frame: np.ndarray) -> np.ndarray:
+    """将帧缩小到最长边不超过 LLM_MAX_SIDE，减少上传数据量和视觉 token"""
+    height, width = frame.shape[:2]
+    scale = LLM_MAX_SIDE / max(height, width)
+    if scale >= 1:
+        return frame
+    return cv2.resize(frame, (int(width * scale), int(height * scale)), interpolation=cv2.INTER_AREA)
+
 def frame_to_base64(frame: np.ndarray) -> str:
     """
-    将视频帧转换为base64编码
+    将视频帧转换为发送给模型的base64编码
     """
     try:
-        # 将OpenCV的BGR格式转换为RGB
-        rgb_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-        
-        # 转换为PIL Image
-        pil_image = Image.fromarray(rgb_frame)
-        
-        # 转换为base64
-        buffered = BytesIO()
-        pil_image.save(buffered, format="JPEG")
-        return base64.b64encode(buffered.getvalue()).decode('utf-8')
+        # 直接对BGR帧进行JPEG编码，无需转换颜色和创建PIL对象
+        ok, buffer = cv2.imencode('.jpg', _prepare_for_llm(frame), [int(cv2.IMWRITE_JPEG_QUALITY), LLM_JPEG_QUALITY])
+        if not ok:
+            raise ValueError("JPEG编码失败")
+        return base64.b64encode(buffer).decode('ascii')
     except Exception as e:
         logger.error(f"转换帧到base64时出错: {e}")
         raise
 
+def _frame_key(frame: np.ndarray) -> bytes:
+    """
+    计算帧下方字幕区域的指纹，只有字幕区域几乎完全相同的帧才会得到相同的指纹
+    缩小并量化灰度后再取摘要，忽略轻微的编码噪声，又能区分不同的字幕
+    """
+    height, width = frame.shape[:2]
+    band = cv2.cvtColor(frame[height * 2 // 3:], cv2.COLOR_BGR2GRAY)
+    band_height = max(1, band.shape[0] * FRAME_KEY_WIDTH // width)
+    small = cv2.resize(band, (FRAME_KEY_WIDTH, band_height), interpolation=cv2.INTER_AREA)
+    return hashlib.blake2b((small >> 4).tobytes(), digest_size=16).digest()
+
+async def extract_text_from_frame(frame: np.ndarray, cache: Optional[dict] = None) -> str:
+    """
+    从帧中提取文字
+    Args:
+        cache: 指纹 -> 识别任务，由调用方在一次字幕提取内共享；
+            相同画面复用已有结果，仍在请求中的相同画面等待同一个请求完成
+    """
+    if cache is None:
+        return await _request_frame_text(frame)
+    
+    key = _frame_key(frame)
+    task = cache.get(key)
+    if task is None:
+        task = asyncio.ensure_future(_request_frame_text(frame))
+        cache[key] = task
+    
+    try:
+        # shield 避免某个等待方被取消时连带取消共享的请求
+        return await asyncio.shield(task)
+    except Exception:
+        # 请求失败时移除，之后相同的画面重新请求
+        if cache.get(key) is task:
+            del cache[key]
+        raise
+
 @retry(
     stop=stop_after_attempt(3),
     wait=wait_exponential(multiplier=1, min=4, max=10),
     reraise=True
 )
-def extract_text_from_frame(frame: np.ndarray) -> str:
+async def _request_frame_text(frame: np.ndarray) -> str:
     """
     使用Llama模型从帧中提取文字，带有重试机制
     """
     try:
-        rate_limiter.wait_if_needed()
+        await rate_limiter.acquire()
         base64_image = frame_to_base64(frame)
         
         messages = [
@@ -137,11 +370,6 @@ def extract_text_from_frame(frame: np.ndarray) -> str:
             }
         ]
 
-        headers = {
-            "Authorization": f"Bearer {GROQ_API_KEY}",
-            "Content-Type": "application/json"
-        }
-        
         payload = {
             "model": "llama-3.2-90b-vision-preview",
             "messages": messages,
@@ -150,102 +378,107 @@ def extract_text_from_frame(frame: np.ndarray) -> str:
             "stream": False
         }
 
-        with httpx.Client(timeout=30.0) as client:
-            response = client.post(
-                GROQ_API_URL,
-                headers=headers,
-                json=payload,
-                timeout=60.0
-            )
+        response = await http_client.post(GROQ_API_URL, json=payload)
+        
+        if response.status_code == 200:
+            result = response.json()
+            text = result['choices'][0]['message']['content'].strip()
             
-            if response.status_code == 200:
-                result = response.json()
-                text = result['choices'][0]['message']['content'].strip()
-                
-                # 增强的文本清理逻辑
-                # 如果文本包含这些词，可能是模型的解释而不是实际字幕
-                ignore_phrases = [
-                    "图片中", "显示", "字幕是", "内容是", "文字是",
-                    "我看到", "这是", "这个", "有", "没有",
-                    "字幕内容", "文本", "识别到"
-                ]
-                
-                for phrase in ignore_phrases:
-                    if phrase in text:
-                        return ""
-                
-                # 如果文本太长，可能是模型的解释
-                if len(text) > 50:
-                    return ""
-                
-                # 去除引号
-                text = text.strip('"').strip("'")
-                
-                return text.strip() if text and len(text) > 1 else ""
-            else:
-                raise Exception(f"API请求失败: {response.status_code}")
+            # 增强的文本清理逻辑
+            # 如果文本包含这些词，可能是模型的解释而不是实际字幕
+            if _IGNORE_RE.search(text):
+                return ""
+            
+            # 如果文本太长，可能是模型的解释
+            if len(text) > 50:
+                return ""
+            
+            # 去除引号
+            text = text.strip('"\'')
+            
+            return text.strip() if text and len(text) > 1 else ""
+        else:
+            raise Exception(f"API请求失败: {response.status_code}")
 
     except Exception as e:
         logger.error(f"从帧提取文本时出错: {e}")
         raise
 
-def extract_subtitles(video_path: str, interval_seconds: float = 1.0) -> List[Tuple[float, str]]:
+async def extract_subtitles(video_path: str, interval_seconds: float = 1.0,
+                            decode_backend: str = "auto") -> List[Tuple[float, str]]:
     """
     从视频中提取字幕，返回带时间戳的字幕列表
     Args:
         video_path: 视频文件路径
         interval_seconds: 抽帧间隔（秒）
+        decode_backend: 解码方式，"auto"、"pyav" 或 "cv2"
     """
     try:
+        # 首次调用时会探测硬件解码设备，放到线程中执行
+        backend = await asyncio.to_thread(resolve_decode_backend, decode_backend, video_path)
+        
+        # 读取视频信息，用于计算帧间隔和进度
         cap = cv2.VideoCapture(video_path)
         fps = int(cap.get(cv2.CAP_PROP_FPS))
         total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
         
         # 根据指定的秒数计算帧间隔
-        interval = int(fps * interval_seconds)
+        interval = max(1, int(fps * interval_seconds))
+        total_samples = total_frames // interval
         
         subtitles = []
-        frame_count = 0
         processed_count = 0
+        in_flight = asyncio.Semaphore(MAX_IN_FLIGHT)
+        frame_texts = {}  # 只在本次提取内复用识别结果，不同视频互不影响
         
-        logger.info(f"开始处理视频，总帧数: {total_frames}, FPS: {fps}, 提取间隔: {interval}帧 ({interval_seconds}秒/帧)")
+        logger.info(f"开始处理视频，总帧数: {total_frames}, FPS: {fps}, 提取间隔: {interval}帧 ({interval_seconds}秒/帧), 解码方式: {backend}")
         
-        while cap.isOpened():
-            ret, frame = cap.read()
-            if not ret:
-                break
-            
-            if frame_count % interval == 0:
-                timestamp = frame_count / fps
-                
-                # 调整图片大小
-                height, width = frame.shape[:2]
-                if width > 1920:
-                    scale = 1920 / width
-                    frame = cv2.resize(frame, None, fx=scale, fy=scale)
-                
-                try:
-                    # 提取文本
-                    text = extract_text_from_frame(frame)
-                    if text:  # 只添加有文本的帧
-                        subtitles.append((timestamp, text))
-                    
-                    processed_count += 1
-                    logger.info(f"处理进度: {processed_count}/{total_frames//interval} (时间: {timestamp:.1f}s)")
-                except Exception as e:
-                    logger.error(f"处理帧 {frame_count} 时出错: {e}")
-                    continue
-            
-            frame_count += 1
+        async def recognize(timestamp: float, frame: np.ndarray):
+            """识别单帧字幕"""
+            nonlocal processed_count
+            try:
+                # 提取文本
+                text = await extract_text_from_frame(frame, frame_texts)
+                if text:  # 只添加有文本的帧
+                    subtitles.append((timestamp, text))
+                processed_count += 1
+                logger.info(f"处理进度: {processed_count}/{total_samples} (时间: {timestamp:.1f}s)")
+            except Exception as e:
+                logger.error(f"处理 {timestamp:.1f}s 处的帧时出错: {e}")
+            finally:
+                in_flight.release()
+        
+        # 解码线程在后台抽帧，事件循环同时并发等待多个API请求
+        if backend == "pyav":
+            frames = iter_pyav_frames(video_path, interval_seconds)
+        else:
+            frames = iter_cv2_frames(cap, interval_seconds)
+        producer = FrameProducer(frames)
+        producer.start()
+        tasks = []
+        try:
+            while True:
+                item = await asyncio.to_thread(producer.queue.get)
+                if item is None:
+                    break
+                await in_flight.acquire()
+                tasks.append(asyncio.create_task(recognize(*item)))
+            await asyncio.gather(*tasks)
+        finally:
+            producer.stop()
+            await asyncio.to_thread(producer.join)
         
         cap.release()
+        
+        # 并发完成顺序不确定，按时间排序
+        subtitles.sort(key=lambda x: x[0])
         return subtitles
         
     except Exception as e:
         logger.error(f"提取字幕时出错: {e}")
         raise
 
-def process_video(video_file, interval_seconds: float = 1.0) -> str:
+async def process_video(video_file, interval_seconds: float = 1.0) -> str:
     """
     处理上传的视频文件
     """
@@ -253,22 +486,17 @@ def process_video(video_file, interval_seconds: float = 1.0) -> str:
         return "请上传视频文件"
         
     try:
-        # 创建临时文件保存上传的视频
-        with tempfile.NamedTemporaryFile(delete=False, suffix='.mp4') as temp_file:
-            temp_path = temp_file.name
-            with open(video_file.name, 'rb') as f:
-                temp_file.write(f.read())
+        # 上传的文件已经在磁盘上，直接使用其路径，无需再复制一份
+        video_path = video_file.name
         
         logger.info(f"开始处理视频: {video_file.name}, 抽帧间隔: {interval_seconds}秒")
         
-        # 初始化去重集合
+        # 初始化去重集合和近似文本索引
         seen_texts = set()
+        similar_index = SimilarTextIndex()
         
         # 提取字幕
-        subtitles = extract_subtitles(temp_path, interval_seconds)
-        
-        # 删除临时文件
-        os.unlink(temp_path)
+        subtitles = await extract_subtitles(video_path, interval_seconds)
         
         # 格式化输出
         if subtitles:
@@ -284,8 +512,7 @@ def process_video(video_file, interval_seconds: float = 1.0) -> str:
                     continue
                     
                 # 将文本按句号、问号等分割成单独的句子
-                sentences = [s.strip() for s in text.replace('。', '。\n').replace('？', '？\n').replace('！', '！\n').split('\n')]
-                sentences = [s for s in sentences if s]  # 移除空字符串
+                sentences = [s.strip() for s in _SENT_SPLIT.split(text) if s.strip()]
                 
                 for sentence in sentences:
                     # 跳过太短的句子
@@ -296,16 +523,12 @@ def process_video(video_file, interval_seconds: float = 1.0) -> str:
                     if sentence in seen_texts:
                         continue
                         
-                    # 检查是否与已有句子过于相似
-                    skip = False
-                    for seen_text in seen_texts:
-                        if _similar_text(sentence, seen_text):
-                            skip = True
-                            break
-                    if skip:
+                    # 检查是否与已有句子过于相似（只比较有相同2-gram的句子）
+                    if similar_index.contains_similar(sentence):
                         continue
                     
                     seen_texts.add(sentence)
+                    similar_index.add(sentence)
                     result.append(f"[{int(timestamp)}s] {sentence}")
             
             return "\n".join(result) if result else "未能从视频中提取到有效字幕"
@@ -320,17 +543,36 @@ def process_video(video_file, interval_seconds: float = 1.0) -> str:
         if 'seen_texts' in locals():
             seen_texts.clear()
 
+def _bigrams(text: str) -> frozenset:
+    """获取文本的2-gram集合"""
+    return frozenset(text[i:i+2] for i in range(len(text) - 1))
+
 def _similar_text(text1: str, text2: str) -> bool:
     """
     检查两段文本是否相似
-    使用简单的似度计算：相同字符的比例
+    使用 rapidfuzz 的归一化编辑距离相似度，超过80分认为是相似文本
     """
-    if abs(len(text1) - len(text2)) > 5:
-        return False
-        
-    # 计算相同字符的数量
-    same_chars = sum(1 for c1, c2 in zip(text1, text2) if c1 == c2)
-    max_len = max(len(text1), len(text2))
-    
-    # 如果相同字符比例超过80%，认为是相似文本
-    return same_chars / max_len > 0.8
\ No newline at end of file
+    return fuzz.ratio(text1, text2) > 80
+
+class SimilarTextIndex:
+    """
+    近似文本去重索引
+    通过 2-gram -> 句子编号 的倒排索引，只和有相同2-gram的句子比较相似度
+    """
+    def __init__(self):
+        self.texts = []
+        self.index = {}
+
+    def contains_similar(self, text: str) -> bool:
+        """是否已存在与 text 相似的句子"""
+        candidates = set()
+        for gram in _bigrams(text):
+            candidates.update(self.index.get(gram, ()))
+        return any(_similar_text(text, self.texts[i]) for i in candidates)
+
+    def add(self, text: str):
+        """加入新句子"""
+        text_id = len(self.texts)
+        self.texts.append(text)
+        for gram in _bigrams(text):
+            self.index.setdefault(gram, set()).add(text_id)
\ No newline at end of file
@@ -3,18 +3,39 @@ import logging
 import tempfile
 import subprocess
 import json
+import re
 from typing import List, Dict, Tuple
 import cv2
-import numpy as np
-from moviepy.editor import VideoFileClip, concatenate_videoclips, vfx, AudioFileClip, CompositeVideoClip
+from scenedetect import detect, ContentDetector
 from modules.video_summary import process_video_summary
-from modules.video_analysis import extract_frames, extract_text_from_frame
-from groq import Groq
+from modules.ratelimit import rate_limiter
+from modules.audio_analysis import FFMPEG_PATH, FFPROBE_PATH
+from modules.video_analysis import extract_frames, extract_text_from_frame, frame_target_size, resize_frame
+from groq import AsyncGroq
 import asyncio
-import concurrent.futures
+import httpx
 
 logger = logging.getLogger(__name__)
-client = Groq(api_key=os.getenv('GROQ_API_KEY'))
+# 异步客户端复用同一个 HTTP/2 连接池，请求不再占用线程池
+client = AsyncGroq(
+    api_key=os.getenv('GROQ_API_KEY'),
+    http_client=httpx.AsyncClient(
+        http2=True,
+        timeout=60.0,
+        limits=httpx.Limits(max_connections=100, max_keepalive_connections=20)
+    )
+)
+
+SCENE_DETECT_THRESHOLD = 27.0  # 镜头切换检测阈值，越小切分越细
+TRANSITION_DURATION = 0.5  # 转场淡入时长（秒）
+MUSIC_VOLUME = 0.3  # 背景音乐音量
+
+# 风格效果对应的 ffmpeg 滤镜，在 ffmpeg 内部处理，无需逐帧回调 Python
+STYLE_FILTERS = {
+    "温馨": "colorchannelmixer=rr=1.1:gg=1.1:bb=1.1",
+    "活力": "colorchannelmixer=rr=1.2:gg=1.2:bb=1.2",
+    "文艺": "hue=s=0"
+}
 
 # 预定义的背景音乐选项
 MUSIC_OPTIONS = {
@@ -36,124 +57,274 @@ class VideoSegment:
         self.audio_score = 0.0
         self.transition_score = 0.0
 
+async def run_ffmpeg(cmd: List[str]):
+    """异步执行 ffmpeg 命令，错误日志写入临时文件，仅在失败时读取"""
+    with tempfile.TemporaryFile() as log_file:
+        process = await asyncio.create_subprocess_exec(
+            FFMPEG_PATH, '-hide_banner', '-loglevel', 'error', '-nostats', *cmd,
+            stdout=asyncio.subprocess.DEVNULL,
+            stderr=log_file
+        )
+        await process.wait()
+        
+        if process.returncode != 0:
+            log_file.seek(0)
+            raise Exception(f"FFmpeg 执行失败: {log_file.read().decode(errors='replace')}")
+
+def compose_canvas(paths: List[str]) -> Tuple[int, int, float]:
+    """
+    计算合成画布的尺寸和帧率：取所有素材中的最大值，尺寸对齐到偶数以满足 libx264 要求
+    Returns:
+        (宽, 高, 帧率)
+    """
+    width, height, fps = 0, 0, 0.0
+    for path in set(paths):
+        cap = cv2.VideoCapture(path)
+        width = max(width, int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)))
+        height = max(height, int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)))
+        fps = max(fps, cap.get(cv2.CAP_PROP_FPS))
+        cap.release()
+    return (width + 1) // 2 * 2, (height + 1) // 2 * 2, fps or 30.0
+
+async def has_audio_stream(video_path: str) -> bool:
+    """使用 ffprobe 检查视频是否包含音轨，检测失败时抛出异常，避免把原音轨误替换为静音"""
+    process = await asyncio.create_subprocess_exec(
+        FFPROBE_PATH,
+        '-v', 'error',
+        '-select_streams', 'a',
+        '-show_entries', 'stream=index',
+        '-of', 'csv=p=0',
+        video_path,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE
+    )
+    stdout, stderr = await process.communicate()
+    if process.returncode != 0:
+        raise Exception(f"FFprobe 检测音轨失败: {stderr.decode(errors='replace')}")
+    return bool(stdout.strip())
+
+async def cut_segment(
+    segment: VideoSegment,
+    output_path: str,
+    canvas: Tuple[int, int, float],
+    style: str,
+    fade_in: bool,
+    has_audio: bool
+):
+    """
+    剪出片段并应用风格和转场，统一编码参数，以便之后直接拼接
+    素材没有音轨时补一条静音音轨，保证所有片段的流布局一致
+    """
+    width, height, fps = canvas
+    # 与 MoviePy 的 compose 方式一致：不缩放，居中放在画布上
+    filters = [f"pad={width}:{height}:(ow-iw)/2:(oh-ih)/2", "setsar=1", f"fps={fps}"]
+    if style in STYLE_FILTERS:
+        filters.append(STYLE_FILTERS[style])
+    if fade_in:
+        filters.append(f"fade=t=in:st=0:d={TRANSITION_DURATION}")
+    
+    if has_audio:
+        silence_input, audio_map = [], '0:a:0'
+    else:
+        silence_input, audio_map = ['-f', 'lavfi', '-i', 'anullsrc=r=44100:cl=stereo'], '1:a'
+    
+    await run_ffmpeg([
+        '-ss', str(segment.start),  # 放在 -i 之前，快速跳转
+        '-i', segment.path,
+        *silence_input,
+        '-t', str(segment.duration),
+        '-shortest',
+        '-map', '0:v:0',
+        '-map', audio_map,
+        '-vf', ','.join(filters),
+        '-c:v', 'libx264',
+        '-preset', 'veryfast',
+        '-pix_fmt', 'yuv420p',
+        '-c:a', 'aac',
+        '-ar', '44100',
+        '-ac', '2',
+        '-y',
+        output_path
+    ])
+
+async def concat_segments(segment_paths: List[str], list_path: str, output_path: str):
+    """使用 concat demuxer 直接复制流拼接片段，不重新编码"""
+    with open(list_path, 'w', encoding='utf-8') as f:
+        for path in segment_paths:
+            f.write(f"file '{path}'\n")
+    
+    await run_ffmpeg([
+        '-f', 'concat',
+        '-safe', '0',
+        '-i', list_path,
+        '-c', 'copy',
+        '-y',
+        output_path
+    ])
+
+async def mix_background_music(video_path: str, music_path: str, output_path: str):
+    """循环背景音乐并与原音轨混合，视频流直接复制（每个片段都带有音轨，拼接结果必然有音轨）"""
+    await run_ffmpeg([
+        '-i', video_path,
+        '-stream_loop', '-1',  # 无限循环音乐，由 amix 按视频音轨长度截断
+        '-i', music_path,
+        '-filter_complex', f"[1:a]volume={MUSIC_VOLUME}[bg];[0:a][bg]amix=inputs=2:duration=first:normalize=0[a]",
+        '-map', '0:v',
+        '-map', '[a]',
+        '-c:v', 'copy',
+        '-c:a', 'aac',
+        '-y',
+        output_path
+    ])
+
+def detect_shots(video_path: str, total_frames: int) -> List[Tuple[int, int]]:
+    """
+    检测镜头边界
+    Returns:
+        (起始帧, 结束帧) 列表，结束帧不包含在内；未检测到切换时整段视频视为一个镜头
+    """
+    scene_list = detect(video_path, ContentDetector(threshold=SCENE_DETECT_THRESHOLD))
+    shots = [(start.get_frames(), end.get_frames()) for start, end in scene_list]
+    return shots or [(0, total_frames)]
+
 async def analyze_video_content(video_path: str) -> List[Dict]:
-    """异步分析视频内容"""
+    """异步分析视频内容，每个镜头只识别一次"""
     scenes = []
     try:
         cap = cv2.VideoCapture(video_path)
-        fps = int(cap.get(cv2.CAP_PROP_FPS))
+        fps = cap.get(cv2.CAP_PROP_FPS)
         total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
-        duration = total_frames / fps
+        if fps <= 0 or total_frames <= 0:
+            logger.warning(f"无法读取视频帧率或帧数，跳过: {video_path}")
+            cap.release()
+            return scenes
+        target_size = frame_target_size(cap)
         
-        # 创建线程池
-        with concurrent.futures.ThreadPoolExecutor(max_workers=3) as executor:
-            futures = []
-            
-            # 每秒末尾帧
-            for second in range(int(duration)):
-                frame_pos = min((second + 1) * fps - 1, total_frames - 1)
-                cap.set(cv2.CAP_PROP_POS_FRAMES, frame_pos)
-                ret, frame = cap.read()
-                if ret:
-                    # 调整图片大小
-                    height, width = frame.shape[:2]
-                    if width > 1920:
-                        scale = 1920 / width
-                        frame = cv2.resize(frame, None, fx=scale, fy=scale)
-                    
-                    # 提交任务到线程池
-                    future = executor.submit(extract_text_from_frame, frame)
-                    futures.append((second, future))
-            
-            # 收集结果
-            for second, future in futures:
-                try:
-                    description = future.result()
-                    if description:
-                        scenes.append({
-                            "time": second,
-                            "description": description
-                        })
-                    logger.info(f"已分析 {second}/{int(duration)} 秒")
-                except Exception as e:
-                    logger.error(f"处理第 {second} 秒时出错: {e}")
+        # 镜头检测需要完整解码一遍视频，放到线程中执行
+        shots = await asyncio.to_thread(detect_shots, video_path, total_frames)
+        logger.info(f"检测到 {len(shots)} 个镜头")
+        
+        tasks = []
+        
+        # 每个镜头取中间帧
+        for start_frame, end_frame in shots:
+            cap.set(cv2.CAP_PROP_POS_FRAMES, (start_frame + end_frame) // 2)
+            ret, frame = cap.read()
+            if ret:
+                # 调整图片大小
+                frame = resize_frame(frame, target_size)
+                
+                # 创建并发识别任务
+                task = asyncio.create_task(extract_text_from_frame(frame))
+                tasks.append((start_frame / fps, (end_frame - start_frame) / fps, task))
         
         cap.release()
+        
+        # 收集结果
+        for i, (start, duration, task) in enumerate(tasks):
+            try:
+                description = await task
+                if description:
+                    scenes.append({
+                        "time": start,
+                        "duration": duration,
+                        "description": description
+                    })
+                logger.info(f"已分析 {i + 1}/{len(tasks)} 个镜头")
+            except Exception as e:
+                logger.error(f"处理 {start:.1f} 秒处的镜头时出错: {e}")
+        
         return scenes
     except Exception as e:
         logger.error(f"分析视频内容时出错: {e}")
         raise
 
-async def match_scenes_with_prompt(scenes: List[Dict], prompt: str) -> List[Tuple[float, float, float]]:
-    """异步评估场景匹配度"""
-    try:
-        scores = []
-        for scene in scenes:
-            # 评估视觉相关性
-            visual_response = await asyncio.to_thread(
-                client.chat.completions.create,
-                model="llama-3.2-90b",
-                messages=[
-                    {
-                        "role": "user",
-                        "content": f"""评估场景与目标的视觉相关性（0-1分）：
-场景：{scene['description']}
-目标：{prompt}
-只返回分数"""
-                    }
-                ],
-                temperature=0.1
-            )
-            
-            # 评估情感匹配度
-            emotion_response = await asyncio.to_thread(
-                client.chat.completions.create,
-                model="llama-3.2-90b",
-                messages=[
-                    {
-                        "role": "user",
-                        "content": f"""评估场景与目标的情感匹配度（0-1分）：
+def parse_scene_scores(text: str) -> Tuple[float, float, float]:
+    """从模型回复中解析 (视觉, 情感, 叙事) 三项评分"""
+    match = re.search(r'\{.*\}', text, re.S)
+    data = json.loads(match.group())
+    return (float(data['visual']), float(data['emotion']), float(data['narrative']))
+
+async def score_scene(scene: Dict, prompt: str) -> Tuple[float, float, float]:
+    """一次请求同时评估场景的视觉相关性、情感匹配度和叙事连贯性"""
+    await rate_limiter.acquire()
+    response = await client.chat.completions.create(
+        model="llama-3.2-90b",
+        messages=[
+            {
+                "role": "user",
+                "content": f"""评估场景与目标的匹配程度，每项为0-1分：
+- visual: 场景与目标的视觉相关性
+- emotion: 场景与目标的情感匹配度
+- narrative: 场景与整体叙事的连贯性
 场景：{scene['description']}
 目标：{prompt}
-只返回分数"""
-                    }
-                ],
-                temperature=0.1
-            )
-            
-            # 评估叙事连贯性
-            narrative_response = await asyncio.to_thread(
-                client.chat.completions.create,
-                model="llama-3.2-90b",
-                messages=[
-                    {
-                        "role": "user",
-                        "content": f"""评估场景与整体叙事的连贯性（0-1分）：
-场景：{scene['description']}
+只返回JSON，例如：{{"visual": 0.5, "emotion": 0.5, "narrative": 0.5}}"""
+            }
+        ],
+        temperature=0.1
+    )
+    
+    try:
+        return parse_scene_scores(response.choices[0].message.content)
+    except:
+        return (0.0, 0.0, 0.0)
+
+async def score_scenes_batch(scenes: List[Dict], prompt: str) -> List[Tuple[float, float, float]]:
+    """
+    一次请求评估所有场景
+    Returns:
+        与 scenes 等长的评分列表；解析失败时抛出异常
+    """
+    scenes_block = "\n".join(f"{i}. {scene['description']}" for i, scene in enumerate(scenes))
+    await rate_limiter.acquire()
+    response = await client.chat.completions.create(
+        model="llama-3.2-90b",
+        messages=[
+            {
+                "role": "user",
+                "content": f"""评估以下每个场景与目标的匹配程度，每项为0-1分：
+- visual: 场景与目标的视觉相关性
+- emotion: 场景与目标的情感匹配度
+- narrative: 场景与整体叙事的连贯性
+场景列表：
+{scenes_block}
 目标：{prompt}
-只返回分数"""
-                    }
-                ],
-                temperature=0.1
-            )
-            
-            try:
-                visual_score = float(visual_response.choices[0].message.content.strip())
-                emotion_score = float(emotion_response.choices[0].message.content.strip())
-                narrative_score = float(narrative_response.choices[0].message.content.strip())
-                scores.append((visual_score, emotion_score, narrative_score))
-            except:
-                scores.append((0.0, 0.0, 0.0))
+按场景顺序只返回一个包含 {len(scenes)} 个对象的JSON数组，例如：[{{"visual": 0.5, "emotion": 0.5, "narrative": 0.5}}]"""
+            }
+        ],
+        temperature=0.1
+    )
+    
+    text = response.choices[0].message.content
+    items = json.loads(re.search(r'\[.*\]', text, re.S).group())
+    if len(items) != len(scenes):
+        raise ValueError(f"评分数量不匹配: {len(items)}/{len(scenes)}")
+    return [(float(item['visual']), float(item['emotion']), float(item['narrative'])) for item in items]
+
+async def match_scenes_with_prompt(scenes: List[Dict], prompt: str) -> List[Tuple[float, float, float]]:
+    """异步评估场景匹配度"""
+    if not scenes:
+        return []
+    
+    try:
+        # 优先一次请求评估所有场景
+        try:
+            return await score_scenes_batch(scenes, prompt)
+        except Exception as e:
+            logger.warning(f"批量评分失败，改为逐个场景评分: {e}")
         
-        return scores
+        # 所有场景并发评估，请求频率由速率限制器控制
+        scores = await asyncio.gather(*[score_scene(scene, prompt) for scene in scenes])
+        return list(scores)
     except Exception as e:
         logger.error(f"场景匹配评分时出错: {e}")
         raise
 
-def polish_prompt(prompt: str) -> str:
+async def polish_prompt(prompt: str) -> str:
     """润色用户输入的提示文本"""
     try:
-        response = client.chat.completions.create(
+        response = await client.chat.completions.create(
             model="llama-3.2-90b",
             messages=[
                 {
@@ -198,7 +369,7 @@ async def process_video_compose(
         # 润色提示文本
         if progress_callback:
             progress_callback("正在优化内容描述...")
-        polished_prompt = polish_prompt(prompt)
+        polished_prompt = await polish_prompt(prompt)
         
         with tempfile.TemporaryDirectory() as temp_dir:
             # 并行分析所有视频
@@ -209,15 +380,8 @@ async def process_video_compose(
                 if progress_callback:
                     progress_callback(f"正在分析第 {i+1}/{len(video_files)} 个视频...")
                 
-                # 保存视频到临时文件
-                temp_path = os.path.join(temp_dir, f"video_{i}.mp4")
-                with open(video_file.name, 'rb') as f:
-                    video_data = f.read()
-                with open(temp_path, 'wb') as f:
-                    f.write(video_data)
-                
-                # 创建异步分析任务
-                task = analyze_video_content(temp_path)
+                # 上传的文件已经在磁盘上，直接使用其路径
+                task = analyze_video_content(video_file.name)
                 analysis_tasks.append(task)
             
             # 等待所有分析完成
@@ -231,9 +395,9 @@ async def process_video_compose(
                     total_score = (visual * 0.4 + emotion * 0.3 + narrative * 0.3)
                     if total_score > 0.6:
                         segment = VideoSegment(
-                            path=os.path.join(temp_dir, f"video_{i}.mp4"),
+                            path=video_files[i].name,
                             start=scene['time'],
-                            duration=1.0,
+                            duration=scene['duration'],
                             score=total_score
                         )
                         segment.description = scene['description']
@@ -251,62 +415,45 @@ async def process_video_compose(
             current_duration = 0
             
             for segment in all_segments:
-                if current_duration + segment.duration <= target_duration:
-                    selected_segments.append(segment)
-                    current_duration += segment.duration
-                if current_duration >= target_duration:
+                remaining = target_duration - current_duration
+                if remaining <= 0:
                     break
+                # 镜头比剩余时长更长时只截取开头部分，保证长镜头也能被选中
+                segment.duration = min(segment.duration, remaining)
+                selected_segments.append(segment)
+                current_duration += segment.duration
+            
+            if not selected_segments:
+                return "未找到符合要求的视频片段", None
             
             if progress_callback:
                 progress_callback("正在合成视频...")
             
-            # 合成视频
-            clips = []
+            # 合成视频：每个片段只经 ffmpeg 编码一次，再直接拼接
+            canvas = compose_canvas([segment.path for segment in selected_segments])
+            source_has_audio = {
+                path: await has_audio_stream(path)
+                for path in {segment.path for segment in selected_segments}
+            }
+            segment_paths = []
             for i, segment in enumerate(selected_segments):
-                clip = VideoFileClip(segment.path).subclip(
-                    segment.start,
-                    segment.start + segment.duration
-                )
-                
-                # 应用风格效果
-                if style == "温馨":
-                    clip = clip.fx(vfx.colorx, 1.1)
-                elif style == "活力":
-                    clip = clip.fx(vfx.colorx, 1.2)
-                elif style == "文艺":
-                    clip = clip.fx(vfx.blackwhite)
-                
-                if i > 0 and transition_type != "无":
-                    clips[-1], clip = apply_transition(clips[-1], clip, transition_type)
-                
-                clips.append(clip)
+                segment_path = os.path.join(temp_dir, f"seg_{i}.mp4")
+                await cut_segment(segment, segment_path, canvas, style, i > 0 and transition_type != "无",
+                                  source_has_audio[segment.path])
+                segment_paths.append(segment_path)
             
-            # 合并视频片段
-            final_clip = concatenate_videoclips(clips, method="compose")
+            # 输出文件放在临时目录之外，函数返回后仍然可用
+            with tempfile.NamedTemporaryFile(delete=False, suffix='.mp4') as temp_output:
+                output_path = temp_output.name
             
-            # 添加背景音乐
-            if style in MUSIC_OPTIONS and os.path.exists(MUSIC_OPTIONS[style]):
-                background_music = AudioFileClip(MUSIC_OPTIONS[style])
-                # 循环音乐以匹配视频长度
-                if background_music.duration < final_clip.duration:
-                    n_loops = int(np.ceil(final_clip.duration / background_music.duration))
-                    background_music = concatenate_videoclips([background_music] * n_loops)
-                # 裁剪音乐以匹配视频长度
-                background_music = background_music.subclip(0, final_clip.duration)
-                # 调整音量
-                background_music = background_music.volumex(0.3)
-                # 合并音频
-                final_clip = final_clip.set_audio(
-                    CompositeVideoClip([final_clip, background_music]).audio
-                )
+            # 没有背景音乐时，拼接结果即为最终输出
+            has_music = style in MUSIC_OPTIONS and os.path.exists(MUSIC_OPTIONS[style])
+            concat_path = os.path.join(temp_dir, "concat.mp4") if has_music else output_path
+            await concat_segments(segment_paths, os.path.join(temp_dir, "list.txt"), concat_path)
             
-            # 导出结果
-            output_path = os.path.join(temp_dir, "output.mp4")
-            final_clip.write_videofile(
-                output_path,
-                codec='libx264',
-                audio_codec='aac'
-            )
+            # 添加背景音乐
+            if has_music:
+                await mix_background_music(concat_path, MUSIC_OPTIONS[style], output_path)
             
             return "视频合成完成！", output_path
             
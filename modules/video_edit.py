@@ -2,9 +2,58 @@ import os
 import logging
 import tempfile
 import subprocess
+from typing import Optional
 
 logger = logging.getLogger(__name__)
 
+# 流式复制结果与目标时长的最大允许偏差（秒），超出时改为重新编码
+COPY_DURATION_TOLERANCE = 0.5
+
+def probe_duration(video_path: str) -> Optional[float]:
+    """
+    使用 ffprobe 获取视频时长（秒），失败时返回 None
+    """
+    cmd = [
+        'ffprobe',
+        '-v', 'error',
+        '-show_entries', 'format=duration',
+        '-of', 'default=noprint_wrappers=1:nokey=1',
+        video_path
+    ]
+    process = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    try:
+        return float(process.stdout.decode().strip())
+    except ValueError:
+        return None
+
+def stream_copy_clip(input_path: str, output_path: str, start_time: float, duration: float) -> bool:
+    """
+    不重新编码，直接复制音视频流剪辑视频
+    Returns:
+        剪辑成功且时长与目标一致时返回 True
+    """
+    cmd = [
+        'ffmpeg',
+        '-ss', str(start_time),  # 放在 -i 之前，快速跳转到最近的关键帧
+        '-i', input_path,
+        '-t', str(duration),
+        '-c', 'copy',  # 直接复制流，不解码也不编码
+        '-avoid_negative_ts', '1',
+        '-y',
+        output_path
+    ]
+    process = subprocess.run(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    if process.returncode != 0:
+        logger.info(f"流式复制失败，改为重新编码: {process.stderr.decode(errors='replace')[-200:]}")
+        return False
+    
+    # 剪辑点不在关键帧上时，复制结果的时长会偏离目标
+    actual_duration = probe_duration(output_path)
+    if actual_duration is None or abs(actual_duration - duration) > COPY_DURATION_TOLERANCE:
+        logger.info(f"流式复制时长不准确 ({actual_duration}s / {duration}s)，改为重新编码")
+        return False
+    return True
+
 def process_video_edit(video_file, start_time: float, end_time: float) -> str:
     """
     剪辑视频
@@ -19,11 +68,8 @@ def process_video_edit(video_file, start_time: float, end_time: float) -> str:
         return None
     
     try:
-        # 创建临时文件保存上传的视频
-        with tempfile.NamedTemporaryFile(delete=False, suffix='.mp4') as temp_input:
-            input_path = temp_input.name
-            with open(video_file.name, 'rb') as f:
-                temp_input.write(f.read())
+        # 上传的文件已经在磁盘上，直接作为 ffmpeg 的输入
+        input_path = video_file.name
         
         # 创建输出文件
         with tempfile.NamedTemporaryFile(delete=False, suffix='.mp4') as temp_output:
@@ -31,8 +77,13 @@ def process_video_edit(video_file, start_time: float, end_time: float) -> str:
         
         logger.info(f"开始剪辑视频: {video_file.name}, 时间范围: {start_time}s - {end_time}s")
         
-        # 构建 ffmpeg 命令
         duration = end_time - start_time
+        
+        # 优先尝试流式复制，剪辑点与关键帧对齐时无需重新编码
+        if stream_copy_clip(input_path, output_path, start_time, duration):
+            return output_path
+        
+        # 构建 ffmpeg 命令
         cmd = [
             'ffmpeg',
             '-i', input_path,  # 输入文件
@@ -56,15 +107,10 @@ def process_video_edit(video_file, start_time: float, end_time: float) -> str:
         if process.returncode != 0:
             raise Exception(f"FFmpeg 执行失败: {process.stderr.decode()}")
         
-        # 删除输入临时文件
-        os.unlink(input_path)
-        
         return output_path
         
     except Exception as e:
         logger.error(f"剪辑视频时出错: {e}")
-        if 'input_path' in locals() and os.path.exists(input_path):
-            os.unlink(input_path)
         if 'output_path' in locals() and os.path.exists(output_path):
             os.unlink(output_path)
         return None 
\ No newline at end of file
@@ -1,85 +1,52 @@
 import os
 import logging
-import tempfile
-import httpx
-from PIL import Image
 import cv2
 import numpy as np
-import io
-import base64
 from tenacity import retry, stop_after_attempt, wait_exponential
-import time
+import asyncio
+from typing import Iterator
 from modules.audio_analysis import extract_audio_from_video, transcribe_audio
+from modules.ratelimit import rate_limiter
+from modules.video_analysis import http_client, frame_target_size, resize_frame, frame_to_base64
 
 logger = logging.getLogger(__name__)
 
 GROQ_API_KEY = os.getenv("GROQ_API_KEY")
 GROQ_API_URL = "https://api.groq.com/openai/v1/chat/completions"
 
-class RateLimiter:
-    def __init__(self, rpm_limit):
-        self.min_interval = 60.0 / rpm_limit
-        self.last_request_time = 0
+MAX_CONCURRENT_FRAMES = 15  # 同时分析的帧数上限
 
-    def wait_if_needed(self):
-        """等待必要的时间以遵守速率限制"""
-        current_time = time.time()
-        elapsed = current_time - self.last_request_time
-        if elapsed < self.min_interval:
-            sleep_time = self.min_interval - elapsed
-            time.sleep(sleep_time)
-        self.last_request_time = time.time()
-
-rate_limiter = RateLimiter(30)  # 30 RPM限制，即每2秒一个请求
-
-def extract_frames(video_path: str) -> list:
-    """提取视频关键帧"""
-    frames = []
+def extract_frames(video_path: str) -> Iterator[np.ndarray]:
+    """提取视频关键帧，逐帧生成"""
+    cap = cv2.VideoCapture(video_path)
     try:
-        cap = cv2.VideoCapture(video_path)
         total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
         
         # 每隔一定间隔提取帧
         interval = max(1, total_frames // 10)  # 最多提取10帧
+        target_size = frame_target_size(cap)
         
         for i in range(0, total_frames, interval):
             cap.set(cv2.CAP_PROP_POS_FRAMES, i)
             ret, frame = cap.read()
             if ret:
                 # 调整图片大小
-                height, width = frame.shape[:2]
-                if width > 1920:
-                    scale = 1920 / width
-                    frame = cv2.resize(frame, None, fx=scale, fy=scale)
-                frames.append(frame)
-                
-        cap.release()
-        return frames
+                yield resize_frame(frame, target_size)
     except Exception as e:
         logger.error(f"提取视频帧时出错: {e}")
         raise
-
-def frame_to_base64(frame: np.ndarray) -> str:
-    """将视频帧转换为base64编码"""
-    try:
-        rgb_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-        pil_image = Image.fromarray(rgb_frame)
-        buffered = io.BytesIO()
-        pil_image.save(buffered, format="JPEG", quality=85)
-        return base64.b64encode(buffered.getvalue()).decode()
-    except Exception as e:
-        logger.error(f"转换帧到base64时出错: {e}")
-        raise
+    finally:
+        cap.release()
 
 @retry(
     stop=stop_after_attempt(3),
     wait=wait_exponential(multiplier=0.5, min=2, max=5),  # 减少等待时间
     reraise=True
 )
-def analyze_frame(frame: np.ndarray) -> str:
+async def analyze_frame(frame: np.ndarray) -> str:
     """分析单个视频帧"""
     try:
-        rate_limiter.wait_if_needed()
+        await rate_limiter.acquire()
         base64_image = frame_to_base64(frame)
         
         messages = [
@@ -100,11 +67,6 @@ def analyze_frame(frame: np.ndarray) -> str:
             }
         ]
         
-        headers = {
-            "Authorization": f"Bearer {GROQ_API_KEY}",
-            "Content-Type": "application/json"
-        }
-        
         payload = {
             "model": "llama-3.2-90b-vision-preview",
             "messages": messages,
@@ -113,13 +75,12 @@ def analyze_frame(frame: np.ndarray) -> str:
             "stream": False
         }
         
-        with httpx.Client(timeout=30.0) as client:
-            response = client.post(GROQ_API_URL, headers=headers, json=payload)
-            if response.status_code == 200:
-                result = response.json()
-                return result['choices'][0]['message']['content'].strip()
-            else:
-                raise Exception(f"API请求失败: {response.status_code}")
+        response = await http_client.post(GROQ_API_URL, json=payload)
+        if response.status_code == 200:
+            result = response.json()
+            return result['choices'][0]['message']['content'].strip()
+        else:
+            raise Exception(f"API请求失败: {response.status_code}")
     except Exception as e:
         logger.error(f"分析帧时出错: {e}")
         raise
@@ -129,10 +90,10 @@ def analyze_frame(frame: np.ndarray) -> str:
     wait=wait_exponential(multiplier=0.5, min=2, max=5),  # 减少等待时间
     reraise=True
 )
-def generate_final_summary(frame_descriptions: list, audio_content: str) -> str:
+async def generate_final_summary(frame_descriptions: list, audio_content: str) -> str:
     """生成最终的视频总结，整合视觉和音频信息"""
     try:
-        rate_limiter.wait_if_needed()
+        await rate_limiter.acquire()
         
         prompt = f"""请基于以下视频的视觉和音频信息，生成一个全面的内容总结：
 
@@ -151,11 +112,6 @@ def generate_final_summary(frame_descriptions: list, audio_content: str) -> str:
 
 请用中文输出，使用简洁清晰的语言，确保总结既包含视觉信息，也包含音频信息。如果视觉和音频信息存在关联，请特别指出。"""
 
-        headers = {
-            "Authorization": f"Bearer {GROQ_API_KEY}",
-            "Content-Type": "application/json"
-        }
-        
         payload = {
             "model": "llama-3.2-90b-vision-preview",
             "messages": [
@@ -169,48 +125,59 @@ def generate_final_summary(frame_descriptions: list, audio_content: str) -> str:
             "stream": False
         }
 
-        with httpx.Client(timeout=30.0) as client:
-            response = client.post(GROQ_API_URL, headers=headers, json=payload)
-            if response.status_code == 200:
-                result = response.json()
-                return result['choices'][0]['message']['content'].strip()
-            else:
-                raise Exception(f"API请求失败: {response.status_code}")
+        response = await http_client.post(GROQ_API_URL, json=payload)
+        if response.status_code == 200:
+            result = response.json()
+            return result['choices'][0]['message']['content'].strip()
+        else:
+            raise Exception(f"API请求失败: {response.status_code}")
     except Exception as e:
         logger.error(f"生成最终总结时出错: {e}")
         raise
 
-def process_video_summary(video_file) -> str:
+async def describe_frames(frames: list) -> list:
+    """并发分析所有视频画面，按帧顺序返回画面描述列表"""
+    semaphore = asyncio.Semaphore(MAX_CONCURRENT_FRAMES)
+    
+    async def bounded_analyze(i: int, frame: np.ndarray) -> str:
+        async with semaphore:
+            description = await analyze_frame(frame)
+        logger.info(f"已完成第 {i+1}/{len(frames)} 帧的分析")
+        return description
+    
+    results = await asyncio.gather(
+        *[bounded_analyze(i, frame) for i, frame in enumerate(frames)],
+        return_exceptions=True
+    )
+    
+    frame_descriptions = []
+    for i, result in enumerate(results):
+        if isinstance(result, Exception):
+            logger.error(f"处理第 {i} 帧时出错: {result}")
+        elif result:
+            frame_descriptions.append(result)
+    return frame_descriptions
+
+async def process_video_summary(video_file) -> str:
     """处理视频并生成综合总结"""
     if video_file is None:
         return "请上传视频文件"
         
     try:
-        # 创建临时文件保存上传的视频
-        with tempfile.NamedTemporaryFile(delete=False, suffix='.mp4') as temp_video:
-            temp_video_path = temp_video.name
-            with open(video_file.name, 'rb') as f:
-                temp_video.write(f.read())
+        # 上传的文件已经在磁盘上，直接使用其路径，无需再复制一份
+        video_path = video_file.name
         
         logger.info(f"开始处理视频总结: {video_file.name}")
         
         # 1. 提取并分析视频帧
-        frames = extract_frames(temp_video_path)
-        frame_descriptions = []
-        for i, frame in enumerate(frames):
-            try:
-                description = analyze_frame(frame)
-                if description:
-                    frame_descriptions.append(description)
-                logger.info(f"已完成第 {i+1}/{len(frames)} 帧的分析")
-            except Exception as e:
-                logger.error(f"处理第 {i} 帧时出错: {e}")
-                continue
+        # 最多10帧，在线程中一次性解码完，避免阻塞事件循环
+        frames = await asyncio.to_thread(list, extract_frames(video_path))
+        frame_descriptions = await describe_frames(frames)
         
         # 2. 提取并分析音频内容
         try:
-            audio_path = extract_audio_from_video(temp_video_path)
-            audio_content = transcribe_audio(audio_path)
+            audio_bytes = await extract_audio_from_video(video_path)
+            audio_content = await transcribe_audio(audio_bytes)
             logger.info("已完成音频内容分析")
         except Exception as e:
             logger.error(f"处理音频时出错: {e}")
@@ -218,13 +185,10 @@ def process_video_summary(video_file) -> str:
         
         # 3. 生成综合总结
         if frame_descriptions or audio_content != "无法提取音频内容":
-            summary = generate_final_summary(frame_descriptions, audio_content)
+            summary = await generate_final_summary(frame_descriptions, audio_content)
         else:
             summary = "无法从视频中提取有效信息"
         
-        # 清理临时文件
-        os.unlink(temp_video_path)
-        
         return summary
         
     except Exception as e: